@@ -63,13 +63,24 @@ investigating specific problems.
 import os
 import re
 import uuid
+import functools
 import yaml
+import zlib
 import zipfile
 import logging
 import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple
-from bs4 import BeautifulSoup
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+from lxml import etree
+
+try:
+    # libyaml bindings are several times faster than the pure-Python classes
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
 
 
 logging.basicConfig(
@@ -78,24 +89,100 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
-
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+EPUB_NS = 'http://www.idpf.org/2007/ops'
+NSMAP = {'xhtml': XHTML_NS}
+ATTRIBUTE_PREFIXES = {
+    'xml': 'http://www.w3.org/XML/1998/namespace',
+    'xlink': 'http://www.w3.org/1999/xlink',
+    'epub': EPUB_NS,
+}
+LIST_TAGS = {f"{{{XHTML_NS}}}{tag}" for tag in ('ul', 'ol', 'li')}
+REQUIRED_STYLESHEETS = ('../styles/style.css', '../styles/fonts.css')
+QUIZ_KEY_TAGS = {f"{{{XHTML_NS}}}{tag}" for tag in ('p', 'div')}
+QUIZ_OPTIONS_XPATH = ".//xhtml:ul[contains(concat(' ', normalize-space(@class), ' '), ' quiz-options ')]"
+XML_DECLARATION_RE = re.compile(rb'^\s*<\?xml[^>]*\?>')
+DOCTYPE_RE = re.compile(rb'<!DOCTYPE', re.IGNORECASE)
+XML_PARSER = etree.XMLParser(remove_blank_text=False, resolve_entities=False)
+HTML_PARSER = etree.HTMLParser(encoding='utf-8')
+
+# Deflate level for text resources in the EPUB archive.  Level 3 is several
+# times faster than zlib's default of 6 and only slightly larger.
+DEFLATE_LEVEL = 3
+# Text totals below this are deflated inline rather than in a process pool
+PARALLEL_DEFLATE_MIN_BYTES = 8 << 20
+PRECOMPRESSED_SUFFIXES = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.woff', '.woff2'}
+
+FINAL_SUFFIX_RE = re.compile(r'[-_]?final$')
+MULTI_HYPHEN_RE = re.compile(r'-{2,}')
+
+IMAGE_MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.svg': 'image/svg+xml',
+}
+FONT_MEDIA_TYPES = {
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+}
+ID_SANITIZE_RE = re.compile(r'[^a-zA-Z0-9]')
+
+NAMED_ENTITIES = {
+    'nbsp': '&#160;',  # non‑breaking space
+    'ensp': '&#8194;',
+    'emsp': '&#8195;',
+    'thinsp': '&#8201;',
+    'ndash': '&#8211;',
+    'mdash': '&#8212;',
+    'hellip': '&#8230;',
+    'lsquo': '&#8216;',
+    'rsquo': '&#8217;',
+    'ldquo': '&#8220;',
+    'rdquo': '&#8221;',
+    'copy': '&#169;',
+    'reg': '&#174;',
+}
+NAMED_ENTITY_RE = re.compile('&(' + '|'.join(map(re.escape, NAMED_ENTITIES)) + ');')
+
+
+@functools.lru_cache(maxsize=4096)
 def normalize_filename(name: str) -> str:
     """Return a normalized filename by lowercasing, replacing spaces with
     hyphens, and removing common suffixes such as '_final'.  File extensions
     are preserved.  The function does not touch directory names.
     """
+    # Already-normalized names (the common case for image sources) skip the regexes
+    if name.islower() and ' ' not in name and 'final' not in name and '--' not in name:
+        return name
     stem, ext = os.path.splitext(name)
     normalized = stem.lower().replace(' ', '-')
     # Remove trailing _final or variations thereof
-    normalized = re.sub(r'-?final$', '', normalized)
+    normalized = FINAL_SUFFIX_RE.sub('', normalized)
     # Collapse multiple consecutive hyphens
-    normalized = re.sub(r'-{2,}', '-', normalized)
+    normalized = MULTI_HYPHEN_RE.sub('-', normalized)
     return f"{normalized}{ext.lower()}"
 
 
 def collect_xhtml_files(root: Path) -> List[Path]:
-    """Recursively gather all XHTML files under the given root directory."""
-    return [p for p in root.rglob('*.xhtml') if p.is_file()]
+    """Recursively gather all XHTML files under the given root directory.
+
+    Walks the tree with os.scandir, whose entries carry their file type, and
+    only wraps matching files in Path objects at the end.
+    """
+    found: List[str] = []
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.xhtml') and entry.is_file():
+                    found.append(entry.path)
+    return [Path(p) for p in found]
 
 
 def rename_files(root: Path) -> Dict[str, str]:
@@ -118,46 +205,87 @@ def rename_files(root: Path) -> Dict[str, str]:
     return mapping
 
 
-def update_references_in_yaml(yaml_path: Path, mapping: Dict[str, str]) -> None:
-    """Update file references in book-map.yaml based on the renaming mapping."""
+def load_book_map(yaml_path: Path) -> Optional[dict]:
+    """Parse book-map.yaml once so every stage can share the result.
+
+    Returns None if the file does not exist or is empty.
+    """
     if not yaml_path.is_file():
-        logging.warning(f"YAML file {yaml_path} not found; skipping update.")
-        return
+        logging.warning(f"YAML file {yaml_path} not found; skipping book map.")
+        return None
     with open(yaml_path, 'r', encoding='utf-8') as f:
-        data = yaml.safe_load(f)
-    # Recursively traverse the YAML structure to replace any old filenames
-    def replace_in_obj(obj):
-        if isinstance(obj, dict):
-            return {k: replace_in_obj(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [replace_in_obj(item) for item in obj]
-        elif isinstance(obj, str):
-            return mapping.get(obj, obj)
-        else:
-            return obj
-    updated = replace_in_obj(data)
+        data = yaml.load(f, Loader=SafeLoader)
+    if data is None:
+        logging.warning(f"YAML file {yaml_path} is empty; skipping book map.")
+    return data
+
+
+def update_references_in_yaml(yaml_path: Path, data: Optional[dict],
+                              mapping: Dict[str, str]) -> Optional[dict]:
+    """Update file references in book-map.yaml based on the renaming mapping.
+
+    `data` is the already-parsed book map and is updated in place.  It is
+    written back to `yaml_path` only if a reference changed, and returned.
+    """
+    # load_book_map has already warned about a missing or empty file
+    if data is None:
+        return None
+    # Walk the YAML structure iteratively and replace old filenames in place
+    replaced = 0
+    stack = [data]
+    while stack:
+        obj = stack.pop()
+        items = obj.items() if isinstance(obj, dict) else enumerate(obj)
+        for key, value in items:
+            if isinstance(value, str):
+                if value in mapping:
+                    obj[key] = mapping[value]
+                    replaced += 1
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
+    if not replaced:
+        return data
     with open(yaml_path, 'w', encoding='utf-8') as f:
-        yaml.dump(updated, f, allow_unicode=True)
-    logging.info(f"Updated references in {yaml_path}.")
+        yaml.dump(data, f, Dumper=SafeDumper, allow_unicode=True)
+    logging.info(f"Updated {replaced} references in {yaml_path}.")
+    return data
 
 
 def update_toc(toc_path: Path, mapping: Dict[str, str]) -> None:
-    """Update hrefs in the Table of Contents XHTML document."""
+    """Update hrefs in the Table of Contents XHTML document.
+
+    Links are rewritten with a single regex over the raw text, which avoids a
+    parse/serialize round trip.  Only `href` attributes are matched (not
+    `data-href` and the like) and comments are skipped; text content that
+    happens to read `href="..."` would still be rewritten.  Names are compared
+    in their escaped markup form (`&` as `&amp;`), and URL fragments
+    (`file.xhtml#id`) are kept.
+    """
     if not toc_path.is_file():
         logging.warning(f"TOC file {toc_path} not found; skipping update.")
         return
+    if not mapping:
+        return
     text = toc_path.read_text(encoding='utf-8')
-    soup = BeautifulSoup(text, 'lxml')
-    modified = False
-    for a in soup.find_all('a', href=True):
-        href = a['href']
-        # Only update relative XHTML links
-        if href in mapping:
-            logging.info(f"Updating TOC link {href} → {mapping[href]}")
-            a['href'] = mapping[href]
-            modified = True
-    if modified:
-        toc_path.write_text(str(soup), encoding='utf-8')
+    # Keyed by how each old name appears inside an attribute value
+    links = {escape(old): (old, new) for old, new in mapping.items()}
+    # Comments are matched first so that links inside them are left alone
+    pattern = re.compile(
+        r'<!--.*?-->|(?<![\w:-])(href\s*=\s*)(["\'])('
+        + '|'.join(map(re.escape, links)) + r')(#[^"\']*)?\2',
+        re.DOTALL,
+    )
+    # Keep the original spacing, quote style and any fragment after the file name
+    def replace_href(match):
+        prefix, quote, href, fragment = match.group(1, 2, 3, 4)
+        if href is None:
+            return match.group(0)
+        old, new = links[href]
+        logging.info(f"Updating TOC link {old} → {new}")
+        return f"{prefix}{quote}{escape(new)}{fragment or ''}{quote}"
+    new_text = pattern.sub(replace_href, text)
+    if new_text != text:
+        toc_path.write_text(new_text, encoding='utf-8')
         logging.info(f"Rewrote TOC file {toc_path} with updated links.")
 
 
@@ -168,128 +296,288 @@ def fix_named_entities(text: str) -> str:
     than the five predefined ones (`&amp;`, `&lt;`, `&gt;`, `&quot;` and `&apos;`)
     should not be used【166870939175638†L123-L176】.  This function replaces
     common entities such as `&nbsp;` and `&mdash;` with their numeric forms.
-    Extend the dictionary below as needed.
+    Extend `NAMED_ENTITIES` as needed; all entities are replaced in a single
+    regex pass.
     """
-    replacements = {
-        '&nbsp;': '&#160;',  # non‑breaking space
-        '&ensp;': '&#8194;',
-        '&emsp;': '&#8195;',
-        '&thinsp;': '&#8201;',
-        '&ndash;': '&#8211;',
-        '&mdash;': '&#8212;',
-        '&hellip;': '&#8230;',
-        '&lsquo;': '&#8216;',
-        '&rsquo;': '&#8217;',
-        '&ldquo;': '&#8220;',
-        '&rdquo;': '&#8221;',
-        '&copy;': '&#169;',
-        '&reg;': '&#174;',
-    }
-    for named, numeric in replacements.items():
-        if named in text:
-            text = text.replace(named, numeric)
-    return text
-
-
-def fix_xhtml_file(path: Path) -> None:
-    """Read an XHTML file, fix common validity issues, and rewrite it."""
-    logging.info(f"Processing {path.relative_to(path.parents[1])}…")
-    original = path.read_text(encoding='utf-8')
-    # Replace problematic named entities
-    corrected = fix_named_entities(original)
-    # Parse with BeautifulSoup to manipulate the DOM
-    soup = BeautifulSoup(corrected, 'lxml')
-    html_tag = soup.find('html')
-    if html_tag:
-        # Ensure required namespaces are present【581872174187472†L127-L130】
-        if not html_tag.has_attr('xmlns'):
-            html_tag['xmlns'] = 'http://www.w3.org/1999/xhtml'
-        if not html_tag.has_attr('xmlns:epub'):
-            html_tag['xmlns:epub'] = 'http://www.idpf.org/2007/ops'
+    return NAMED_ENTITY_RE.sub(lambda m: NAMED_ENTITIES[m.group(1)], text)
+
+
+def _parse_xhtml(data: bytes, name: str) -> etree._ElementTree:
+    """Parse XHTML bytes into an lxml tree.
+
+    Well-formed documents go through the XML parser directly.  Documents
+    that fail (typically unclosed `<hr>` tags inside lists) are recovered
+    with lxml's HTML parser, which closes such tags the way a browser would.
+    """
+    try:
+        return etree.ElementTree(etree.fromstring(data, XML_PARSER))
+    except etree.XMLSyntaxError as exc:
+        logging.warning(f"{name} is not well-formed ({exc}); recovering with the HTML parser.")
+    # The HTML parser would turn the XML declaration into a comment
+    data = XML_DECLARATION_RE.sub(b'', data, count=1)
+    tree = etree.ElementTree(etree.fromstring(data, HTML_PARSER))
+    # libxml2 invents an HTML 4 DOCTYPE when the source has none; EPUB 3
+    # content must not carry it
+    if not DOCTYPE_RE.search(data):
+        tree.docinfo.clear()
+    return tree
+
+
+def _qualify_name(name: str, prefixes: Dict[str, str]) -> str:
+    """Map a prefixed name such as `xml:lang` to Clark notation.
+
+    Names whose prefix is not in `prefixes` are returned unchanged.
+    """
+    prefix, _, local = name.partition(':')
+    if local and prefix in prefixes:
+        return f"{{{prefixes[prefix]}}}{local}"
+    return name
+
+
+def _pop_declarations(el: etree._Element) -> Tuple[Optional[str], Dict[str, str]]:
+    """Remove the literal `xmlns`/`xmlns:*` attributes the HTML parser leaves.
+
+    Returns the declared default namespace (or None) and declared prefixes.
+    """
+    default = None
+    prefixes: Dict[str, str] = {}
+    for name in [n for n in el.attrib if n == 'xmlns' or n.startswith('xmlns:')]:
+        value = el.attrib.pop(name)
+        if name == 'xmlns':
+            default = value
+        else:
+            prefixes[name[len('xmlns:'):]] = value
+    return default, prefixes
+
+
+def _namespace_descendants(root: etree._Element, prefixes: Dict[str, str]) -> None:
+    """Move elements the HTML parser left without a namespace into one.
+
+    Elements go into the XHTML namespace unless an ancestor-or-self carries a
+    literal `xmlns` attribute (inline SVG, for example), in which case that
+    namespace is used and the attributes become real declarations.  Prefixed
+    attributes are qualified when the prefix is known and left alone
+    otherwise.
+    """
+    stack = [(child, XHTML_NS, prefixes) for child in root.iterchildren(etree.Element)]
+    while stack:
+        el, default_ns, scope = stack.pop()
+        declared_default, declared = _pop_declarations(el)
+        if declared_default or declared:
+            # lxml cannot add declarations to an existing element, so swap in
+            # a new one that carries them
+            default_ns = declared_default or default_ns
+            scope = {**scope, **declared}
+            nsmap = dict(declared)
+            if declared_default:
+                nsmap[None] = declared_default
+            tag = el.tag if el.tag.startswith('{') else f"{{{default_ns}}}{el.tag}"
+            new_el = etree.Element(_qualify_name(tag, scope), nsmap=nsmap)
+            for name, value in el.attrib.items():
+                qualified = _qualify_name(name, scope)
+                if ':' in qualified and not qualified.startswith('{'):
+                    logging.warning(f"Dropping attribute {name} with an undeclared prefix.")
+                    continue
+                new_el.set(qualified, value)
+            new_el.text, new_el.tail = el.text, el.tail
+            new_el.extend(el)
+            el.getparent().replace(el, new_el)
+            el = new_el
+        else:
+            if ':' not in el.tag:
+                el.tag = f"{{{default_ns}}}{el.tag}"
+            elif not el.tag.startswith('{'):
+                # Prefixed tags are only qualified when the prefix is known
+                qualified = _qualify_name(el.tag, scope)
+                if qualified != el.tag:
+                    el.tag = qualified
+            for name in [n for n in el.attrib if ':' in n and not n.startswith('{')]:
+                qualified = _qualify_name(name, scope)
+                if qualified != name:
+                    el.set(qualified, el.attrib.pop(name))
+        stack.extend((child, default_ns, scope) for child in el.iterchildren(etree.Element))
+
+
+def _ensure_namespaces(tree: etree._ElementTree) -> etree._ElementTree:
+    """Return a tree whose root declares the XHTML and EPUB namespaces.
+
+    lxml cannot add namespace declarations to an existing element, so when
+    either is missing the root is rebuilt from a skeleton document (keeping
+    the original DOCTYPE) and the children and top-level siblings are moved
+    across.  Elements that are not yet in a namespace, as produced by the
+    HTML parser, are moved into one by `_namespace_descendants`.
+    """
+    root = tree.getroot()
+    if root.nsmap.get(None) == XHTML_NS and root.nsmap.get('epub') == EPUB_NS:
+        return tree
+    in_xhtml_ns = root.nsmap.get(None) == XHTML_NS
+    # The HTML parser leaves the root's declarations as plain attributes
+    _, declared = _pop_declarations(root)
+    nsmap = {prefix: uri for prefix, uri in root.nsmap.items() if prefix}
+    nsmap.update(declared)
+    nsmap['epub'] = EPUB_NS
+    declarations = ''.join(f' xmlns:{prefix}="{uri}"' for prefix, uri in nsmap.items())
+    skeleton = f'{tree.docinfo.doctype}<html xmlns="{XHTML_NS}"{declarations}/>'
+    new_root = etree.fromstring(skeleton.encode('utf-8'), XML_PARSER)
+    prefixes = {**ATTRIBUTE_PREFIXES, **nsmap}
+    for name, value in root.attrib.items():
+        qualified = _qualify_name(name, prefixes)
+        if ':' in qualified and not qualified.startswith('{'):
+            logging.warning(f"Dropping attribute {name} with an undeclared prefix.")
+            continue
+        new_root.set(qualified, value)
+    new_root.text = root.text
+    new_root.extend(root)
+    # Keep top-level comments and processing instructions around the root,
+    # in document order
+    for sibling in reversed(list(root.itersiblings(preceding=True))):
+        new_root.addprevious(sibling)
+    for sibling in reversed(list(root.itersiblings())):
+        new_root.addnext(sibling)
+    if not in_xhtml_ns:
+        _namespace_descendants(new_root, prefixes)
+    return new_root.getroottree()
+
+
+def _detach(el: etree._Element) -> None:
+    """Remove an element from its parent, keeping its tail text in place."""
+    parent = el.getparent()
+    if el.tail:
+        previous = el.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + el.tail
+        else:
+            parent.text = (parent.text or '') + el.tail
+        el.tail = None
+    parent.remove(el)
+
+
+def fix_xhtml_file(tree: etree._ElementTree, name: str) -> bool:
+    """Fix common validity issues in a parsed XHTML tree.
+
+    The tree is modified in place.  Returns True if it was modified.
+    """
+    dirty = False
+    root = tree.getroot()
     # Move <hr> tags out of lists
-    for hr in soup.find_all('hr'):
-        parent = hr.parent
-        if parent and parent.name in {'ul', 'ol', 'li'}:
-            hr.extract()
-            # Move up until we exit list contexts
-            target = parent
-            while target.name in {'li', 'ul', 'ol'} and target.parent:
-                target = target.parent
-            target.insert_after(hr)
-    # Remove stray inline style attributes and fix stylesheet links
-    for tag in soup.find_all(True):
-        if tag.has_attr('style'):
-            del tag['style']
+    for hr in root.xpath(
+        './/xhtml:hr[parent::xhtml:ul or parent::xhtml:ol or parent::xhtml:li]',
+        namespaces=NSMAP,
+    ):
+        # Move up until we exit list contexts
+        target = hr.getparent()
+        while target.tag in LIST_TAGS and target.getparent() is not None:
+            target = target.getparent()
+        _detach(hr)
+        target.addnext(hr)
+        dirty = True
+    # Remove stray inline style attributes
+    for el in root.xpath('//*[@style]'):
+        del el.attrib['style']
+        dirty = True
     # Ensure stylesheet links
-    head = soup.find('head')
-    if head:
-        existing_hrefs = [link.get('href') for link in head.find_all('link', href=True)]
-        styles_to_ensure = ['../styles/style.css', '../styles/fonts.css']
-        for href in styles_to_ensure:
+    head = root.find('xhtml:head', NSMAP)
+    if head is not None:
+        existing_hrefs = {link.get('href') for link in head.iterfind('xhtml:link[@href]', NSMAP)}
+        for href in REQUIRED_STYLESHEETS:
             if href not in existing_hrefs:
-                new_link = soup.new_tag('link', rel='stylesheet', href=href)
-                head.append(new_link)
+                etree.SubElement(head, f"{{{XHTML_NS}}}link", rel='stylesheet', href=href)
+                dirty = True
     # Normalize image src attributes
-    for img in soup.find_all('img', src=True):
-        src = img['src']
+    for img in root.iterfind('.//xhtml:img[@src]', NSMAP):
+        src = img.get('src')
         normalized_src = normalize_filename(src)
         if normalized_src != src:
-            logging.info(f"Updating image src in {path.name}: {src} → {normalized_src}")
-            img['src'] = normalized_src
+            logging.info(f"Updating image src in {name}: {src} → {normalized_src}")
+            img.set('src', normalized_src)
+            dirty = True
         # Add alt text if missing
-        if not img.has_attr('alt') or img['alt'] == '':
+        if not img.get('alt'):
             description = Path(normalized_src).stem.replace('-', ' ').capitalize()
-            img['alt'] = f"Illustration: {description}"
-    # Write back to file
-    path.write_text(str(soup), encoding='utf-8')
+            img.set('alt', f"Illustration: {description}")
+            dirty = True
+    return dirty
+
 
+def populate_quiz_options(tree: etree._ElementTree, name: str) -> bool:
+    """Ensure each quiz has at least four options by adding placeholders.
 
-def populate_quiz_options(path: Path) -> None:
-    """Ensure each quiz has at least four options by adding placeholders."""
-    text = path.read_text(encoding='utf-8')
-    soup = BeautifulSoup(text, 'lxml')
+    Returns True if the tree was modified.
+    """
     modified = False
-    for ul in soup.find_all('ul', class_='quiz-options'):
-        options = ul.find_all('li', recursive=False)
-        count = len(options)
+    for ul in tree.getroot().xpath(QUIZ_OPTIONS_XPATH, namespaces=NSMAP):
+        count = len(ul.findall('xhtml:li', NSMAP))
         if count < 4:
             for i in range(count + 1, 5):
-                new_li = soup.new_tag('li')
-                new_li.string = f"Placeholder option {i}"
-                ul.append(new_li)
+                new_li = etree.SubElement(ul, f"{{{XHTML_NS}}}li")
+                new_li.text = f"Placeholder option {i}"
                 modified = True
     if modified:
-        path.write_text(str(soup), encoding='utf-8')
-        logging.info(f"Populated missing quiz options in {path.name}")
+        logging.info(f"Populated missing quiz options in {name}")
+    return modified
 
 
-def restructure_quiz_key(path: Path) -> None:
-    """Convert quiz answers into an ordered list or definition list for clarity."""
-    text = path.read_text(encoding='utf-8')
-    soup = BeautifulSoup(text, 'lxml')
-    body = soup.find('body')
-    if not body:
-        return
-    paragraphs = body.find_all(['p', 'div'], recursive=False)
+def restructure_quiz_key(tree: etree._ElementTree, name: str) -> bool:
+    """Convert quiz answers into an ordered list or definition list for clarity.
+
+    Returns True if the tree was modified.
+    """
+    body = tree.getroot().find('xhtml:body', NSMAP)
+    if body is None:
+        return False
+    paragraphs = [el for el in body if el.tag in QUIZ_KEY_TAGS]
     if not paragraphs:
-        return
-    ol = soup.new_tag('ol')
+        return False
+    ol = etree.Element(f"{{{XHTML_NS}}}ol")
     for para in paragraphs:
-        text_content = para.get_text(strip=True)
-        li = soup.new_tag('li')
-        li.string = text_content
-        ol.append(li)
-        para.decompose()
+        li = etree.SubElement(ol, f"{{{XHTML_NS}}}li")
+        li.text = ''.join(fragment.strip() for fragment in para.itertext())
+        _detach(para)
     body.append(ol)
-    path.write_text(str(soup), encoding='utf-8')
-    logging.info(f"Restructured quiz key in {path.name}")
+    logging.info(f"Restructured quiz key in {name}")
+    return True
 
 
-def build_content_opf(root: Path, yaml_path: Path, opf_path: Path) -> None:
-    """Generate the content.opf file based on the book map and existing files."""
+def process_file(path: Path) -> None:
+    """Parse an XHTML file once, apply every fix to the tree and write it once.
+
+    Kept at module level so it can be dispatched to worker processes.
+    """
+    logging.info(f"Processing {path.relative_to(path.parents[1])}…")
+    data = path.read_bytes()
+    original = data.decode('utf-8')
+    # Replace problematic named entities
+    corrected = fix_named_entities(original)
+    # Parse with lxml to manipulate the tree, reusing the raw bytes when the
+    # entity pass changed nothing
+    if corrected != original:
+        data = corrected.encode('utf-8')
+    parsed = _parse_xhtml(data, path.name)
+    # Ensure required namespaces are present【581872174187472†L127-L130】
+    tree = _ensure_namespaces(parsed)
+    # A rebuilt root means namespaces were added, which is always the case for
+    # documents recovered with the HTML parser, so those are rewritten too
+    modified = corrected != original or tree is not parsed
+    modified |= fix_xhtml_file(tree, path.name)
+    # Most files have no quizzes; a substring probe is far cheaper than XPath
+    if b'quiz-options' in data:
+        modified |= populate_quiz_options(tree, path.name)
+    if 'quizkey' in path.stem.lower():
+        modified |= restructure_quiz_key(tree, path.name)
+    # Clean documents are left untouched, so re-runs skip serialization
+    if modified:
+        tree.write(str(path), encoding='utf-8', xml_declaration=True)
+
+
+def build_content_opf(root: Path, data: Optional[dict], opf_path: Path,
+                      xhtml_files: Optional[List[Path]] = None) -> None:
+    """Generate the content.opf file based on the book map and existing files.
+
+    `data` is the parsed book map, or None if there is none.  Pass
+    `xhtml_files` to reuse an earlier `collect_xhtml_files` scan.
+    """
     metadata = {}
-    if yaml_path.is_file():
-        data = yaml.safe_load(yaml_path.read_text(encoding='utf-8'))
+    if data is not None:
         metadata['title'] = data.get('title', 'Untitled Book')
         metadata['creator'] = data.get('author', 'Unknown Author')
         metadata['language'] = data.get('language', 'en')
@@ -305,52 +593,30 @@ def build_content_opf(root: Path, yaml_path: Path, opf_path: Path) -> None:
             'subject': '',
             'rights': ''
         }
-    xhtml_files = collect_xhtml_files(root)
-    manifest_items = []
-    spine_items = []
-    for i, file_path in enumerate(sorted(xhtml_files)):
-        rel_path = file_path.relative_to(root)
-        item_id = f"item{i+1}"
-        manifest_items.append(
-            f'<item id="{item_id}" href="{rel_path.as_posix()}" media-type="application/xhtml+xml"/>'
-        )
-        spine_items.append(f'<itemref idref="{item_id}" />')
+    if xhtml_files is None:
+        xhtml_files = collect_xhtml_files(root)
+    xhtml_hrefs = [file_path.relative_to(root).as_posix() for file_path in sorted(xhtml_files)]
+    manifest_items = [
+        f'<item id="item{i}" href="{href}" media-type="application/xhtml+xml"/>'
+        for i, href in enumerate(xhtml_hrefs, start=1)
+    ]
+    spine_items = [f'<itemref idref="item{i}" />' for i in range(1, len(xhtml_hrefs) + 1)]
     styles_dir = root / 'styles'
     if styles_dir.exists():
-        for css_file in styles_dir.glob('*.css'):
-            css_id = css_file.stem
-            manifest_items.append(
-                f'<item id="{css_id}" href="styles/{css_file.name}" media-type="text/css"/>'
-            )
-    images_dir = root / 'images'
-    if images_dir.exists():
-        for img_file in images_dir.iterdir():
-            if img_file.suffix.lower() in {'.jpg', '.jpeg', '.png', '.gif', '.svg'}:
-                mime_map = {
-                    '.jpg': 'image/jpeg',
-                    '.jpeg': 'image/jpeg',
-                    '.png': 'image/png',
-                    '.gif': 'image/gif',
-                    '.svg': 'image/svg+xml'
-                }
-                media_type = mime_map[img_file.suffix.lower()]
-                img_id = re.sub(r'[^a-zA-Z0-9]', '_', img_file.stem)
-                manifest_items.append(
-                    f'<item id="{img_id}" href="images/{img_file.name}" media-type="{media_type}"/>'
-                )
-    fonts_dir = root / 'fonts'
-    if fonts_dir.exists():
-        for font_file in fonts_dir.iterdir():
-            if font_file.suffix.lower() in {'.ttf', '.otf', '.woff', '.woff2'}:
-                mime_map = {
-                    '.ttf': 'font/ttf',
-                    '.otf': 'font/otf',
-                    '.woff': 'font/woff',
-                    '.woff2': 'font/woff2'
-                }
-                font_id = re.sub(r'[^a-zA-Z0-9]', '_', font_file.stem)
+        manifest_items.extend(
+            f'<item id="{css_file.stem}" href="styles/{css_file.name}" media-type="text/css"/>'
+            for css_file in styles_dir.glob('*.css')
+        )
+    for dir_name, media_types in (('images', IMAGE_MEDIA_TYPES), ('fonts', FONT_MEDIA_TYPES)):
+        asset_dir = root / dir_name
+        if not asset_dir.exists():
+            continue
+        for asset in asset_dir.iterdir():
+            media_type = media_types.get(asset.suffix.lower())
+            if media_type:
+                asset_id = ID_SANITIZE_RE.sub('_', asset.stem)
                 manifest_items.append(
-                    f'<item id="{font_id}" href="fonts/{font_file.name}" media-type="{mime_map[font_file.suffix.lower()]}"/>'
+                    f'<item id="{asset_id}" href="{dir_name}/{asset.name}" media-type="{media_type}"/>'
                 )
     manifest_str = '\n        '.join(manifest_items)
     spine_str = '\n        '.join(spine_items)
@@ -377,13 +643,78 @@ def build_content_opf(root: Path, yaml_path: Path, opf_path: Path) -> None:
     logging.info(f"Generated {opf_path.relative_to(root.parent)} with {len(manifest_items)} manifest items.")
 
 
-def create_epub(root: Path, output_path: Path, opf_path: Path) -> None:
+def _deflate_file(path: str) -> Tuple[bytes, int, int]:
+    """Raw-deflate a file for a ZIP entry.
+
+    Returns the compressed data, the CRC-32 and the uncompressed size.
+    """
+    data = Path(path).read_bytes()
+    compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(), zlib.crc32(data), len(data)
+
+
+def _write_deflated(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo,
+                    payload: bytes, crc: int, size: int) -> None:
+    """Append an entry whose data was already deflated by `_deflate_file`.
+
+    zipfile has no public API for precompressed data, so this does what
+    ZipFile.open(..., 'w') and _ZipWriteFile.close() do for a seekable file,
+    with the sizes and CRC known up front.
+    """
+    if zf._writing:
+        raise ValueError("Can't write to the ZIP file while another write handle is open.")
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.flag_bits = 0x00
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    zinfo.compress_size = len(payload)
+    zip64 = size > zipfile.ZIP64_LIMIT or len(payload) > zipfile.ZIP64_LIMIT
+    if zip64 and not zf._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+    zf.fp.seek(zf.start_dir)
+    zinfo.header_offset = zf.fp.tell()
+    zf._writecheck(zinfo)
+    zf._didModify = True
+    zf.fp.write(zinfo.FileHeader(zip64))
+    zf.fp.write(payload)
+    zf.start_dir = zf.fp.tell()
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+
+def _deflate_files(paths: List[Path], jobs: Optional[int]) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield `_deflate_file` results for `paths`, in order.
+
+    Small inputs, or a single worker, are deflated inline since starting a
+    pool would cost more than it saves.  Otherwise at most a few files per
+    worker are in flight at once, so memory stays bounded by that window
+    rather than by the size of the whole archive.
+    """
+    workers = jobs or os.cpu_count() or 1
+    if workers == 1 or sum(path.stat().st_size for path in paths) < PARALLEL_DEFLATE_MIN_BYTES:
+        for path in paths:
+            yield _deflate_file(str(path))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_deflate_file, str(path)))
+        while pending:
+            yield pending.popleft().result()
+
+
+def create_epub(root: Path, output_path: Path, opf_path: Path,
+                jobs: Optional[int] = None) -> None:
     """Create a ZIP‑based EPUB archive from the contents of root.
 
     The mimetype file must be written first and without compression【931734531720391†L92-L179】.
     The META-INF/container.xml must reference the OPF file.  This function
     constructs the necessary files on the fly and then zips the entire
-    directory structure into `output_path`.
+    directory structure into `output_path`.  Text resources are deflated at
+    a low level, across up to `jobs` worker processes for large books, while
+    already-compressed images and fonts are stored as-is.
     """
     mimetype_path = root / 'mimetype'
     meta_inf_dir = root / 'META-INF'
@@ -399,15 +730,27 @@ def create_epub(root: Path, output_path: Path, opf_path: Path) -> None:
   </rootfiles>
 </container>'''
     container_path.write_text(container_xml, encoding='utf-8')
+    # Archive names are sliced from the path string rather than built
+    # with relative_to()/as_posix() for every entry
+    prefix_len = len(str(root)) + 1
+    entries = []
+    for path in root.rglob('*'):
+        if path == mimetype_path or not path.is_file():
+            continue
+        arcname = str(path)[prefix_len:].replace(os.sep, '/')
+        # Images and fonts are already compressed; deflating them again
+        # costs time for next to no gain
+        entries.append((path, arcname, path.suffix.lower() not in PRECOMPRESSED_SUFFIXES))
     with zipfile.ZipFile(output_path, 'w') as zf:
         zf.write(mimetype_path, 'mimetype', compress_type=zipfile.ZIP_STORED)
-        for dirpath, _, filenames in os.walk(root):
-            for filename in filenames:
-                path = Path(dirpath) / filename
-                rel = path.relative_to(root)
-                if rel.as_posix() == 'mimetype':
-                    continue
-                zf.write(path, rel.as_posix(), compress_type=zipfile.ZIP_DEFLATED)
+        # Results come back in submission order, so the archive layout is
+        # deterministic
+        deflated = _deflate_files([path for path, _, deflate in entries if deflate], jobs)
+        for path, arcname, deflate in entries:
+            if deflate:
+                _write_deflated(zf, zipfile.ZipInfo.from_file(path, arcname), *next(deflated))
+            else:
+                zf.write(path, arcname, compress_type=zipfile.ZIP_STORED)
     logging.info(f"Created EPUB archive at {output_path}.")
 
 
@@ -416,11 +759,17 @@ def run_epubcheck(epub_path: Path, epubcheck_jar: Path) -> None:
     if not epubcheck_jar.is_file():
         logging.warning("EPUBCheck JAR not found; skipping validation.")
         return
-    result = subprocess.run([
-        'java', '-jar', str(epubcheck_jar), str(epub_path)
-    ], capture_output=True, text=True)
-    logging.info("EPUBCheck output:\n" + result.stdout)
-    if result.returncode != 0:
+    logging.info("EPUBCheck output:")
+    # Stream messages as they arrive instead of buffering the whole report;
+    # EPUBCheck prints its errors on stderr, so merge it into the same stream
+    with subprocess.Popen(
+        ['java', '-Dfile.encoding=UTF-8', '-jar', str(epubcheck_jar), str(epub_path)],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        encoding='utf-8', errors='replace', bufsize=1,
+    ) as proc:
+        for line in proc.stdout:
+            logging.info(line.rstrip())
+    if proc.returncode != 0:
         logging.error("EPUBCheck found errors.")
     else:
         logging.info("EPUBCheck completed with no critical errors.")
@@ -434,22 +783,24 @@ def main():
     parser.add_argument('--toc', default='3-TableOfContents.xhtml', help='Path to TOC XHTML relative to project root')
     parser.add_argument('--output', default='output.epub', help='Output EPUB file name (in parent dir)')
     parser.add_argument('--epubcheck', default='epubcheck.jar', help='Path to EPUBCheck JAR')
+    parser.add_argument('--jobs', type=int, default=None, help='Worker processes for XHTML fixes and compression (default: CPU count)')
     args = parser.parse_args()
     project_root = Path(args.project_dir).resolve()
     yaml_path = (project_root / args.yaml).resolve()
     toc_path = (project_root / args.toc).resolve()
     mapping = rename_files(project_root)
-    update_references_in_yaml(yaml_path, mapping)
+    book_map = load_book_map(yaml_path)
+    book_map = update_references_in_yaml(yaml_path, book_map, mapping)
     update_toc(toc_path, mapping)
-    for file_path in collect_xhtml_files(project_root):
-        fix_xhtml_file(file_path)
-        populate_quiz_options(file_path)
-        if 'quizkey' in file_path.stem.lower():
-            restructure_quiz_key(file_path)
+    # File names are final from here on, so one scan serves every later stage
+    xhtml_files = collect_xhtml_files(project_root)
+    # Files are independent at this point, so process them in parallel
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        list(executor.map(process_file, xhtml_files, chunksize=4))
     opf_path = project_root / 'content.opf'
-    build_content_opf(project_root, yaml_path, opf_path)
+    build_content_opf(project_root, book_map, opf_path, xhtml_files=xhtml_files)
     output_epub = project_root.parent / args.output
-    create_epub(project_root, output_epub, opf_path)
+    create_epub(project_root, output_epub, opf_path, jobs=args.jobs)
     run_epubcheck(output_epub, Path(args.epubcheck))
 
 
@@ -0,0 +1,41 @@
+from lxml import etree
+
+import prepare_epub
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+
+def _process(tmp_path, markup):
+    path = tmp_path / 'OEBPS' / 'page.xhtml'
+    path.parent.mkdir()
+    path.write_text(markup, encoding='utf-8')
+    prepare_epub.process_file(path)
+    return path.read_bytes()
+
+
+def test_recovered_document_keeps_inline_svg_namespaces(tmp_path):
+    # The unclosed <hr> forces the HTML parser fallback
+    output = _process(tmp_path, (
+        '<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title></head><body>'
+        '<ul><li>a<hr></li></ul>'
+        f'<svg xmlns="{SVG_NS}" xmlns:xlink="{XLINK_NS}"><image xlink:href="x.png"/></svg>'
+        '</body></html>'
+    ))
+    root = etree.fromstring(output)
+    svg = root.find(f'.//{{{SVG_NS}}}svg')
+    assert svg is not None
+    assert 'xmlns' not in svg.attrib
+    image = svg.find(f'{{{SVG_NS}}}image')
+    assert image.get(f'{{{XLINK_NS}}}href') == 'x.png'
+
+
+def test_recovered_document_without_doctype_gets_none(tmp_path):
+    # The bare '&' forces the HTML parser fallback
+    output = _process(tmp_path, (
+        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title></head>'
+        '<body><p>a & b</p></body></html>'
+    ))
+    assert b'<!DOCTYPE' not in output
+    assert etree.fromstring(output).find('.//{http://www.w3.org/1999/xhtml}p').text == 'a & b'